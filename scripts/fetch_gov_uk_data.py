@@ -19,12 +19,23 @@ Based on:
 
 import os
 import sys
-import json
+import gzip
+import time
+import random
+import hashlib
 import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any
+from operator import attrgetter
+from typing import Any, BinaryIO, Callable, Iterator, TypeVar
 
-import requests
+import ijson
+import orjson
+import httpx
 
 # Configure logging
 logging.basicConfig(
@@ -49,6 +60,23 @@ TOKEN_PATHS = [
     "/v1/oauth/token",                       # Version prefixed
 ]
 
+# Token request styles, in probe order, with their log labels
+TOKEN_STYLES = {
+    "json": "JSON format",
+    "form": "Form-urlencoded",
+    "basic": "Basic Auth",
+}
+
+# Statuses meaning the token path does not exist, so other auth styles
+# against the same path are pointless
+MISSING_ENDPOINT_STATUSES = {404, 405}
+
+# OAuth error codes meaning the token path is right but the credentials
+# are not. A single one is not conclusive, since a server that only reads
+# credentials from a form body or Basic header rejects the JSON style this
+# way, so probing stops only once every style on a path has returned one.
+CREDENTIAL_ERRORS = {"invalid_client", "invalid_grant", "unauthorized_client"}
+
 # Prices endpoint path (from Rest API PDF and API Authentication PDF)
 # GET /v1/prices?fuel_type=unleaded
 PRICES_PATH = "/v1/prices"
@@ -58,23 +86,106 @@ PRICES_PATH = "/v1/prices"
 # We map to standard codes
 FUEL_TYPES = ["E10", "E5", "B7", "SDV"]
 
+# Brand used when the API record has none
+DEFAULT_BRAND = "Unknown"
+
+# Shared empty mapping for missing nested objects; never mutated
+_EMPTY: dict[str, Any] = {}
+
+# Guards the shared aggregation dict the fetch workers merge into
+_MERGE_LOCK = threading.Lock()
+
+T = TypeVar("T")
+
 # Request timeout in seconds
 REQUEST_TIMEOUT = 30
 
+# Retry policy for transient failures: exponential backoff with jitter,
+# honouring Retry-After when the server sends it
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+RETRY_ERRORS = (httpx.NetworkError, httpx.TimeoutException, httpx.RemoteProtocolError)
+
+# Shared HTTP client so the token probes and fuel-type requests reuse one
+# connection instead of a fresh TCP+TLS handshake each. With HTTP/2 the
+# concurrent fuel-type requests are multiplexed over that one connection.
+CLIENT = httpx.Client(
+    http2=True,
+    headers={"Accept": "application/json"},
+    timeout=REQUEST_TIMEOUT,
+    limits=httpx.Limits(max_connections=8, max_keepalive_connections=4)
+)
+
+# Where access tokens are cached between runs, and how long before expiry
+# a cached token stops being reused
+TOKEN_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "fuelsaver"
+)
+TOKEN_EXPIRY_MARGIN = 60
 
-def get_access_token() -> str:
+
+@dataclass(slots=True)
+class Location:
+    """Station coordinates."""
+    latitude: float
+    longitude: float
+
+
+@dataclass(slots=True)
+class Station:
+    """
+    Station in the CMA-compatible format the iOS app expects.
+    
+    Field names and order match the output JSON; orjson serialises these
+    dataclasses directly, so no intermediate dicts are built.
+    """
+    site_id: str
+    brand: str
+    address: str
+    postcode: str
+    location: Location
+    prices: dict[str, float]
+
+
+@dataclass(slots=True)
+class _Entry:
+    """
+    Aggregation state for one site_id while fuel types are being fetched.
+    
+    Records are ranked by (FUEL_TYPES index, position in that response), so
+    the result does not depend on which fetch worker gets there first.
+    """
+    rank: tuple[int, int]
+    station: Station | None  # None if the defining record was rejected
+    warning: str | None  # Logged once if the station is rejected
+    prices: dict[tuple[int, int], dict[str, float]]
+
+
+def get_access_token(refresh: bool = False) -> str:
     """
     Obtain OAuth 2.0 access token using client credentials.
     
-    Tries multiple endpoint paths and both JSON and form-urlencoded formats
-    as the documentation shows different approaches.
+    Reuses a token cached on disk by an earlier run while it is still valid,
+    unless refresh is set, in which case the cached token is discarded.
+    Otherwise tries multiple endpoint paths and both JSON and form-urlencoded
+    formats as the documentation shows different approaches, starting with
+    the path and format that issued the last token. A path that returns
+    404/405 is skipped without trying the remaining formats. Probing stops
+    once every format on a path has returned an OAuth credentials error, or
+    when a request still fails to connect or times out after its retries.
     
+    Args:
+        refresh: Discard any cached token, e.g. after the API rejected it
+        
     Returns:
         Access token string
         
     Raises:
-        ValueError: If credentials are not set
-        requests.RequestException: If all token requests fail
+        ValueError: If credentials are not set or are rejected
+        httpx.HTTPError: If all token requests fail
     """
     client_id = os.environ.get("GOV_UK_CLIENT_ID")
     client_secret = os.environ.get("GOV_UK_CLIENT_SECRET")
@@ -84,289 +195,636 @@ def get_access_token() -> str:
             "Missing OAuth credentials. Set GOV_UK_CLIENT_ID and GOV_UK_CLIENT_SECRET environment variables."
         )
     
+    cache_path = _token_cache_path(client_id)
+    cache = _load_token_cache(cache_path)
+    if refresh and "token" in cache:
+        # Don't let later runs reuse the rejected token either, but keep the
+        # learned token endpoint
+        cache = {"winning": cache["winning"]} if "winning" in cache else {}
+        _save_token_cache(cache_path, cache)
+    if cache.get("token") and cache.get("expires_at", 0) - time.time() > TOKEN_EXPIRY_MARGIN:
+        logger.info("Using cached access token")
+        return cache["token"]
+    
+    token, expires_in, winning = _request_access_token(client_id, client_secret, cache.get("winning"))
+    cache = {"winning": winning}
+    if expires_in:
+        cache.update(token=token, expires_at=time.time() + expires_in)
+    _save_token_cache(cache_path, cache)
+    return token
+
+
+def _request_access_token(
+    client_id: str,
+    client_secret: str,
+    winning: dict[str, str] | None = None
+) -> tuple[str, int | None, dict[str, str]]:
+    """
+    Probe the token endpoints for a new access token.
+    
+    Args:
+        client_id: OAuth client ID
+        client_secret: OAuth client secret
+        winning: Path and style that issued the last token, tried first
+        
+    Returns:
+        Tuple of access token, its lifetime in seconds (None if not given)
+        and the path and style that issued it
+    """
+    attempts = [(path, style) for path in TOKEN_PATHS for style in TOKEN_STYLES]
+    if winning:
+        learned = (winning.get("path"), winning.get("style"))
+        if learned in attempts:
+            attempts.remove(learned)
+            attempts.insert(0, learned)
+    
     last_error = None
+    missing_paths = set()
+    rejected_styles: dict[str, set[str]] = {}
     
-    for token_path in TOKEN_PATHS:
+    for token_path, style in attempts:
+        if token_path in missing_paths:
+            continue
+        
         token_url = f"{API_BASE_URL}{token_path}"
-        logger.info(f"Trying token endpoint: {token_url}")
+        label = TOKEN_STYLES[style]
+        logger.info(f"Trying {label} at token endpoint: {token_url}")
         
-        # Try 1: JSON format (as per API Docs PDF)
         try:
-            response = requests.post(
-                token_url,
-                json={
-                    "client_id": client_id,
-                    "client_secret": client_secret
-                },
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "application/json"
-                },
-                timeout=REQUEST_TIMEOUT
-            )
+            response = _post_token(style, token_url, client_id, client_secret)
             if response.status_code == 200:
-                logger.info(f"Success with JSON format at {token_path}")
-                return _extract_token(response.json())
-            logger.warning(f"JSON format returned {response.status_code}: {response.text[:200]}")
-        except requests.RequestException as e:
-            logger.warning(f"JSON format failed for {token_path}: {e}")
+                try:
+                    data = _json(response)
+                except orjson.JSONDecodeError as e:
+                    # e.g. an HTML page from a path that isn't the token endpoint
+                    logger.warning(f"{label} returned non-JSON 200 for {token_path}: {e}")
+                    last_error = e
+                    continue
+                logger.info(f"Success with {label} at {token_path}")
+                token, expires_in = _extract_token(data)
+                return token, expires_in, {"path": token_path, "style": style}
+            logger.warning(f"{label} returned {response.status_code}: {response.text[:200]}")
+            error = _credential_error(response)
+            if error:
+                rejected = rejected_styles.setdefault(token_path, set())
+                rejected.add(style)
+                if len(rejected) == len(TOKEN_STYLES):
+                    raise ValueError(f"Token endpoint rejected credentials: {error}")
+            elif response.status_code in MISSING_ENDPOINT_STATUSES:
+                missing_paths.add(token_path)
+        except RETRY_ERRORS as e:
+            # Every token path is on the same host, so once retries run out
+            # on a connection error or timeout the other probes would too
+            logger.warning(f"{label} failed for {token_path}: {e}")
+            raise
+        except httpx.HTTPError as e:
+            logger.warning(f"{label} failed for {token_path}: {e}")
             last_error = e
+    
+    raise httpx.HTTPError(f"All token endpoints failed. Last error: {last_error}")
+
+
+def _post_token(style: str, token_url: str, client_id: str, client_secret: str) -> httpx.Response:
+    """
+    Send one token request in the given auth style.
+    
+    Args:
+        style: Key of TOKEN_STYLES
+        token_url: Token endpoint URL
+        client_id: OAuth client ID
+        client_secret: OAuth client secret
         
-        # Try 2: Form-urlencoded with all OAuth fields (as per API Authentication PDF)
-        try:
-            response = requests.post(
-                token_url,
-                data={
-                    "grant_type": "client_credentials",
-                    "client_id": client_id,
-                    "client_secret": client_secret,
-                    "scope": "fuelfinder.read"
-                },
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "Accept": "application/json"
-                },
-                timeout=REQUEST_TIMEOUT
-            )
-            if response.status_code == 200:
-                logger.info(f"Success with form-urlencoded at {token_path}")
-                return _extract_token(response.json())
-            logger.warning(f"Form-urlencoded returned {response.status_code}: {response.text[:200]}")
-        except requests.RequestException as e:
-            logger.warning(f"Form-urlencoded failed for {token_path}: {e}")
-            last_error = e
+    Returns:
+        The token endpoint response
+    """
+    # JSON format (as per API Docs PDF)
+    if style == "json":
+        return _request_with_retry(
+            "POST",
+            token_url,
+            json={
+                "client_id": client_id,
+                "client_secret": client_secret
+            },
+            headers={"Content-Type": "application/json"}
+        )
+    
+    form = {
+        "grant_type": "client_credentials",
+        "scope": "fuelfinder.read"
+    }
+    
+    # Form-urlencoded with all OAuth fields (as per API Authentication PDF)
+    if style == "form":
+        return _request_with_retry(
+            "POST",
+            token_url,
+            data={**form, "client_id": client_id, "client_secret": client_secret},
+            headers={"Content-Type": "application/x-www-form-urlencoded"}
+        )
+    
+    # Basic Auth with client credentials (alternative OAuth pattern)
+    if style == "basic":
+        return _request_with_retry(
+            "POST",
+            token_url,
+            data=form,
+            auth=(client_id, client_secret),
+            headers={"Content-Type": "application/x-www-form-urlencoded"}
+        )
+    
+    raise ValueError(f"Unknown token request style: {style}")
+
+
+def _request_with_retry(
+    method: str,
+    url: str,
+    *,
+    max_retries: int = MAX_RETRIES,
+    base: float = RETRY_BASE_DELAY,
+    cap: float = RETRY_MAX_DELAY,
+    auth: tuple[str, str] | None = None,
+    consume: Callable[[httpx.Response], T] | None = None,
+    **kwargs: Any
+) -> httpx.Response | T:
+    """
+    Send a request on the shared client, retrying transient failures.
+    
+    Retries on 429/5xx responses and on connection errors or timeouts,
+    sleeping with exponential backoff plus jitter between attempts, or for
+    the Retry-After interval (capped at cap) when the server provides one.
+    Other responses are returned as-is for the caller to handle.
+    
+    With consume, the body is streamed and the response is passed to it
+    instead of being returned. Connection errors or timeouts while it reads
+    the body are retried from the same budget, so consume must start from
+    scratch on each call.
+    
+    Args:
+        method: HTTP method
+        url: Request URL
+        max_retries: Number of retries after the first attempt
+        base: Initial backoff delay in seconds
+        cap: Maximum backoff delay in seconds
+        auth: Optional Basic Auth credentials
+        consume: Optional reader for the streamed response
+        **kwargs: Passed through to httpx.Client.build_request
+        
+    Returns:
+        The final response, or what consume returned for it
         
-        # Try 3: Basic Auth with client credentials (alternative OAuth pattern)
+    Raises:
+        httpx.TransportError: If the last attempt fails to connect
+    """
+    attempt = 0
+    while True:
         try:
-            response = requests.post(
-                token_url,
-                data={
-                    "grant_type": "client_credentials",
-                    "scope": "fuelfinder.read"
-                },
-                auth=(client_id, client_secret),
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "Accept": "application/json"
-                },
-                timeout=REQUEST_TIMEOUT
-            )
-            if response.status_code == 200:
-                logger.info(f"Success with Basic Auth at {token_path}")
-                return _extract_token(response.json())
-            logger.warning(f"Basic Auth returned {response.status_code}: {response.text[:200]}")
-        except requests.RequestException as e:
-            logger.warning(f"Basic Auth failed for {token_path}: {e}")
-            last_error = e
+            request = CLIENT.build_request(method, url, **kwargs)
+            response = CLIENT.send(request, auth=auth, stream=consume is not None)
+            if consume is not None and (response.status_code not in RETRY_STATUSES or attempt >= max_retries):
+                try:
+                    return consume(response)
+                finally:
+                    response.close()
+        except RETRY_ERRORS as e:
+            if attempt >= max_retries:
+                raise
+            delay = _backoff_delay(attempt, base, cap)
+            logger.warning(f"{method} {url} failed ({e}), retrying in {delay:.1f}s")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt >= max_retries:
+                return response
+            delay = _retry_after(response)
+            if delay is None:
+                delay = _backoff_delay(attempt, base, cap)
+            else:
+                # Never let the server stall a scheduled run beyond the cap
+                delay = min(cap, delay)
+            logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def _backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff delay with up to 50% jitter."""
+    return min(cap, base * 2 ** attempt) * (1 + random.random() * 0.5)
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    """Seconds to wait from a Retry-After header, if present and numeric."""
+    value = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _json(response: httpx.Response) -> Any:
+    """Parse a response body with orjson, skipping the text decode step."""
+    return orjson.loads(response.content)
+
+
+def _credential_error(response: httpx.Response) -> str | None:
+    """Return the OAuth error code if the token endpoint rejected the credentials."""
+    if response.status_code not in (400, 401, 403):
+        return None
     
-    raise requests.RequestException(f"All token endpoints failed. Last error: {last_error}")
+    try:
+        data = _json(response)
+    except ValueError:
+        return None
+    
+    error = data.get("error") if isinstance(data, dict) else None
+    return error if error in CREDENTIAL_ERRORS else None
 
 
-def _extract_token(data: dict) -> str:
-    """Extract access token from response data."""
+def _extract_token(data: dict) -> tuple[str, int | None]:
+    """Extract access token and its lifetime in seconds from response data."""
     # Handle wrapped format: {"success": true, "data": {"access_token": "..."}}
     if data.get("success") and "data" in data:
-        token = data["data"].get("access_token")
-    else:
-        # Standard OAuth format: {"access_token": "..."}
-        token = data.get("access_token")
+        data = data["data"]
+    # Standard OAuth format: {"access_token": "...", "expires_in": 3600}
+    token = data.get("access_token")
     
     if not token:
         raise ValueError(f"No access token in response: {data}")
     
+    try:
+        expires_in = int(data["expires_in"])
+    except (KeyError, TypeError, ValueError):
+        expires_in = None
+    
     logger.info("Successfully obtained access token")
-    return token
+    return token, expires_in
+
+
+def _token_cache_path(client_id: str) -> str:
+    """Cache file for a client ID, hashed so several credentials can coexist."""
+    digest = hashlib.sha256(client_id.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(TOKEN_CACHE_DIR, f"token-{digest}.json")
+
+
+def _load_token_cache(cache_path: str) -> dict[str, Any]:
+    """Read the token cache file, returning an empty dict if missing, unreadable or malformed."""
+    try:
+        with open(cache_path, "rb") as f:
+            cache = orjson.loads(f.read())
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable token cache {cache_path}: {e}")
+        return {}
+    
+    if not _valid_token_cache(cache):
+        logger.warning(f"Ignoring malformed token cache {cache_path}")
+        return {}
+    return cache
+
+
+def _valid_token_cache(cache: Any) -> bool:
+    """Check the cache fields have the types get_access_token relies on."""
+    if not isinstance(cache, dict):
+        return False
+    if "token" in cache or "expires_at" in cache:
+        expires_at = cache.get("expires_at")
+        if not isinstance(cache.get("token"), str):
+            return False
+        if not isinstance(expires_at, (int, float)) or isinstance(expires_at, bool):
+            return False
+    winning = cache.get("winning")
+    if winning is not None:
+        if not isinstance(winning, dict):
+            return False
+        if not all(isinstance(winning.get(key), str) for key in ("path", "style")):
+            return False
+    return True
+
+
+def _save_token_cache(cache_path: str, cache: dict[str, Any]) -> None:
+    """Write the token cache file, readable only by the current user."""
+    try:
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        fd = os.open(cache_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(cache))
+    except OSError as e:
+        logger.warning(f"Could not write token cache {cache_path}: {e}")
 
 
-def fetch_prices_by_fuel_type(token: str, fuel_type: str) -> list[dict[str, Any]]:
+def fetch_prices_by_fuel_type(token: str, fuel_type: str, by_id: dict[str, _Entry]) -> None:
     """
-    Fetch fuel prices for a specific fuel type.
+    Fetch fuel prices for a specific fuel type and merge them into by_id.
+    
+    The response body is parsed incrementally and each station is
+    transformed as soon as it is parsed, so the raw payload is never held
+    in memory. Stations are buffered per attempt and merged into by_id only
+    once the whole response has been read, so a connection error or
+    timeout partway through can be retried without leaving stale records.
     
     Args:
         token: OAuth access token
         fuel_type: Fuel type code (E10, E5, B7, SDV)
-        
-    Returns:
-        List of station dictionaries
+        by_id: Aggregation state keyed by site_id, updated in place
     """
+    fuel_rank = FUEL_TYPES.index(fuel_type)
     prices_url = f"{API_BASE_URL}{PRICES_PATH}"
     logger.info(f"Fetching {fuel_type} prices from {prices_url}...")
     
-    response = requests.get(
+    def read(response: httpx.Response) -> tuple[dict[str, _Entry], int]:
+        response.raise_for_status()
+        entries: dict[str, _Entry] = {}
+        count = _ingest_stream(entries, response, fuel_rank)
+        return entries, count
+    
+    entries, count = _request_with_retry(
+        "GET",
         prices_url,
         params={"fuel_type": fuel_type},
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json"
-        },
-        timeout=REQUEST_TIMEOUT
+        headers={"Authorization": f"Bearer {token}"},
+        consume=read
     )
+    _merge_entries(by_id, entries)
     
-    response.raise_for_status()
+    logger.info(f"Fetched {count} stations with {fuel_type} prices")
+
+
+def _merge_entries(by_id: dict[str, _Entry], entries: dict[str, _Entry]) -> None:
+    """
+    Merge one fuel type's aggregation state into the shared by_id.
     
-    data = response.json()
-    stations = data.get("stations", [])
+    Ranks from different fuel types never collide, so the lower-ranked
+    entry keeps defining the station and the price maps combine cleanly.
+    Safe to call concurrently with the same by_id.
     
-    logger.info(f"Fetched {len(stations)} stations with {fuel_type} prices")
-    return stations
+    Args:
+        by_id: Aggregation state keyed by site_id, updated in place
+        entries: Aggregation state for a single fuel type
+    """
+    with _MERGE_LOCK:
+        for site_id, entry in entries.items():
+            existing = by_id.get(site_id)
+            if existing is None:
+                by_id[site_id] = entry
+                continue
+            if entry.rank < existing.rank:
+                existing.rank = entry.rank
+                existing.station = entry.station
+                existing.warning = entry.warning
+            existing.prices.update(entry.prices)
 
 
-def aggregate_stations(all_stations: list[dict[str, Any]]) -> list[dict[str, Any]]:
+def _ingest_stream(by_id: dict[str, _Entry], response: httpx.Response, fuel_rank: int) -> int:
     """
-    Aggregate stations and merge prices by site_id.
-    
-    Stations may appear multiple times (once per fuel type). This function
-    merges them into single station objects with all available prices.
+    Parse a streamed prices response and ingest each station as it arrives.
     
     Args:
-        all_stations: List of all station records (may have duplicates)
+        by_id: Aggregation state keyed by site_id, updated in place
+        response: Streamed prices response
+        fuel_rank: FUEL_TYPES index of the response's fuel type
         
     Returns:
-        List of unique stations with merged prices
+        Number of stations in the response
+    """
+    count = 0
+    # Feed decoded chunks to ijson's push parser as they arrive
+    stations: list[dict[str, Any]] = ijson.sendable_list()
+    parser = ijson.items_coro(stations, "stations.item", use_float=True)
+    for chunk in response.iter_bytes():
+        parser.send(chunk)
+        for station in stations:
+            _ingest(by_id, station, (fuel_rank, count))
+            count += 1
+        del stations[:]
+    parser.close()
+    for station in stations:
+        _ingest(by_id, station, (fuel_rank, count))
+        count += 1
+    return count
+
+
+def _ingest(by_id: dict[str, _Entry], station: dict[str, Any], rank: tuple[int, int]) -> None:
     """
-    logger.info(f"Aggregating {len(all_stations)} station records...")
+    Merge one GOV UK API station record into by_id.
     
-    by_id: dict[str, dict[str, Any]] = {}
+    Stations may appear multiple times (once per fuel type). The record with
+    the lowest rank defines the station's details, or rejects the station if
+    its coordinates are invalid, as the first record did when fuel types
+    were fetched one after another. Every record's prices are kept by rank
+    and merged in rank order at the end.
     
-    for station in all_stations:
-        # Use site_id as unique identifier (12-character geohash)
-        site_id = station.get("site_id")
-        if not site_id:
-            continue
-        
-        if site_id not in by_id:
-            # First occurrence: store the station
-            by_id[site_id] = station.copy()
-            # Ensure prices is a dict
-            if not isinstance(by_id[site_id].get("prices"), dict):
-                by_id[site_id]["prices"] = {}
+    Args:
+        by_id: Aggregation state keyed by site_id, updated in place
+        station: Station record from GOV UK API
+        rank: (FUEL_TYPES index, position in that response) of the record
+    """
+    # Use site_id as unique identifier (12-character geohash)
+    site_id = station.get("site_id")
+    if not site_id:
+        return
+    
+    # No throwaway {} for missing prices; the exact type check skips
+    # malformed values that would break dict.update
+    prices = station.get("prices")
+    
+    entry = by_id.get(site_id)
+    if entry is None or rank < entry.rank:
+        cma_station, warning = _to_station(site_id, station)
+        if entry is None:
+            entry = by_id[site_id] = _Entry(rank, cma_station, warning, {})
         else:
-            # Subsequent occurrence: merge prices
-            existing_prices = by_id[site_id].get("prices", {})
-            new_prices = station.get("prices", {})
-            if isinstance(new_prices, dict):
-                existing_prices.update(new_prices)
-            by_id[site_id]["prices"] = existing_prices
-    
-    unique_stations = list(by_id.values())
-    logger.info(f"Aggregated to {len(unique_stations)} unique stations")
-    
-    return unique_stations
+            entry.rank = rank
+            entry.station = cma_station
+            entry.warning = warning
+    if prices and type(prices) is dict:
+        entry.prices[rank] = prices
 
 
-def transform_to_cma_format(stations: list[dict[str, Any]]) -> list[dict[str, Any]]:
+def _to_station(site_id: str, station: dict[str, Any]) -> tuple[Station | None, str | None]:
     """
-    Transform GOV UK API response to CMA-compatible format for iOS app.
-    
-    The iOS app expects the CMA Open Data Schema format.
+    Transform a GOV UK API station record to the CMA-compatible format.
     
     Args:
-        stations: List of stations from GOV UK API
+        site_id: The record's site_id
+        station: Station record from GOV UK API
         
     Returns:
-        List of stations in CMA format
+        Tuple of the station without prices (None if the coordinates are
+        invalid) and a warning to log if it is rejected
     """
-    transformed = []
-    
-    for station in stations:
-        # Extract location coordinates
-        location = station.get("location", {})
-        lat = location.get("latitude")
-        lng = location.get("longitude")
-        
-        # Skip stations without valid coordinates
-        if lat is None or lng is None:
-            continue
-        
-        # Validate coordinate bounds
-        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
-            logger.warning(f"Invalid coordinates for station {station.get('site_id')}: lat={lat}, lng={lng}")
-            continue
-        
-        # Build address from available fields
-        address_parts = []
-        address_obj = station.get("address", {})
-        if isinstance(address_obj, dict):
-            if address_obj.get("line1"):
-                address_parts.append(address_obj["line1"])
-            if address_obj.get("town"):
-                address_parts.append(address_obj["town"])
-            postcode = address_obj.get("postcode", "")
-        elif isinstance(address_obj, str):
+    # Extract location coordinates
+    location = station.get("location") or _EMPTY
+    lat = location.get("latitude")
+    lng = location.get("longitude")
+    
+    # Skip stations without valid coordinates
+    if lat is None or lng is None:
+        return None, None
+    
+    # Validate coordinate bounds
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None, f"Invalid coordinates for station {site_id}: lat={lat}, lng={lng}"
+    
+    # Build address from available fields
+    address_parts = []
+    address_obj = station.get("address", _EMPTY)
+    address_type = type(address_obj)
+    if address_type is dict:
+        line1 = address_obj.get("line1")
+        if line1:
+            address_parts.append(line1)
+        town = address_obj.get("town")
+        if town:
+            address_parts.append(town)
+        postcode = address_obj.get("postcode", "")
+    else:
+        if address_type is str:
             address_parts.append(address_obj)
-            postcode = station.get("postcode", "")
-        else:
-            postcode = station.get("postcode", "")
-        
-        address = ", ".join(address_parts) if address_parts else station.get("address", "")
-        
-        # Build CMA-compatible station object
-        cma_station = {
-            "site_id": station.get("site_id", ""),
-            "brand": station.get("brand", "Unknown"),
-            "address": address,
-            "postcode": postcode,
-            "location": {
-                "latitude": lat,
-                "longitude": lng
-            },
-            "prices": station.get("prices", {})
-        }
-        
-        transformed.append(cma_station)
-    
-    return transformed
+        postcode = station.get("postcode", "")
+    
+    address = ", ".join(address_parts) if address_parts else station.get("address", "")
+    
+    # Build CMA-compatible station object; prices are merged in afterwards
+    cma_station = Station(
+        site_id=site_id,
+        brand=station.get("brand", DEFAULT_BRAND),
+        address=address,
+        postcode=postcode,
+        location=Location(latitude=lat, longitude=lng),
+        prices={}
+    )
+    return cma_station, None
 
 
-def fetch_all_prices(token: str) -> list[dict[str, Any]]:
+def fetch_all_prices(token: str) -> list[Station]:
     """
     Fetch all fuel prices from GOV UK API.
     
-    Fetches prices for each fuel type and aggregates them.
+    Fetches prices for each fuel type concurrently, transforming and
+    aggregating stations as they arrive. The requests are I/O-bound, so
+    running them in parallel over the shared client makes the fetch phase
+    take roughly one round trip instead of one per fuel type.
     
     Args:
         token: OAuth access token
         
     Returns:
-        List of aggregated station dictionaries
+        List of unique stations with merged prices
     """
-    all_stations = []
-    
-    for fuel_type in FUEL_TYPES:
-        try:
-            stations = fetch_prices_by_fuel_type(token, fuel_type)
-            all_stations.extend(stations)
-        except requests.HTTPError as e:
-            logger.error(f"Failed to fetch {fuel_type} prices: {e}")
-            # Continue with other fuel types
+    by_id: dict[str, _Entry] = {}
+    
+    with ThreadPoolExecutor(max_workers=len(FUEL_TYPES)) as executor:
+        # Each worker streams one fuel type and merges it into the shared
+        # dict once its response has been read in full
+        futures = {
+            fuel_type: executor.submit(fetch_prices_by_fuel_type, token, fuel_type, by_id)
+            for fuel_type in FUEL_TYPES
+        }
+        for fuel_type, future in futures.items():
+            try:
+                future.result()
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 401:
+                    # The token itself was rejected; no fuel type will succeed
+                    raise
+                logger.error(f"Failed to fetch {fuel_type} prices: {e}")
+                # Continue with other fuel types
+    
+    # Publish in first-seen order, merging prices as a sequential fetch would
+    unique_stations = []
+    for entry in sorted(by_id.values(), key=attrgetter("rank")):
+        station = entry.station
+        if station is None:
+            if entry.warning:
+                logger.warning(entry.warning)
+            continue
+        for rank in sorted(entry.prices):
+            station.prices.update(entry.prices[rank])
+        unique_stations.append(station)
+    logger.info(f"Aggregated to {len(unique_stations)} unique stations")
     
-    return aggregate_stations(all_stations)
+    return unique_stations
 
 
-def save_output(stations: list[dict[str, Any]], output_path: str) -> None:
+def save_output(stations: list[Station], output_path: str) -> None:
     """
     Save aggregated data to JSON file.
     
+    Output is compact by default since it is published to the iOS app;
+    set PRETTY_JSON=1 to indent it for human-readable diffs. A gzipped
+    copy is written alongside as <output_path>.gz. Both files are replaced
+    atomically, so readers never see a partially written file.
+    
     Args:
-        stations: List of station dictionaries
+        stations: List of stations
         output_path: Path to output JSON file
     """
     output = {
         "last_updated": datetime.now(timezone.utc).isoformat(),
         "source": "GOV UK Fuel Finder API",
-        "station_count": len(stations),
-        "stations": stations
+        "station_count": len(stations)
     }
     
     # Ensure output directory exists
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    if os.environ.get("PRETTY_JSON"):
+        output["stations"] = stations
+        chunks = [orjson.dumps(output, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)]
+    else:
+        chunks = _output_chunks(output, stations)
+    
+    with (
+        _atomic_writer(output_path) as f,
+        _atomic_writer(f"{output_path}.gz") as gz_file,
+        gzip.GzipFile(filename="", fileobj=gz_file, mode="wb", compresslevel=6, mtime=0) as gz
+    ):
+        for chunk in chunks:
+            f.write(chunk)
+            gz.write(chunk)
     
     logger.info(f"Saved {len(stations)} stations to {output_path}")
 
 
+def _output_chunks(header: dict[str, Any], stations: list[Station]) -> Iterator[bytes]:
+    """
+    Encode the compact output document one station at a time.
+    
+    Only one station is encoded at any moment, instead of the whole
+    document being built in memory before it is written.
+    
+    Args:
+        header: Top-level fields written before the stations array
+        stations: List of stations
+        
+    Yields:
+        Consecutive pieces of the JSON document
+    """
+    # Reopen the encoded header object to append the stations array
+    yield orjson.dumps(header)[:-1] + b',"stations":['
+    for i, station in enumerate(stations):
+        if i:
+            yield b","
+        yield orjson.dumps(station)
+    yield b"]}\n"
+
+
+@contextmanager
+def _atomic_writer(path: str) -> Iterator[BinaryIO]:
+    """Write to a temporary file in the same directory, then rename it over path."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
 def main() -> int:
     """
     Main entry point.
@@ -381,18 +839,19 @@ def main() -> int:
         # Get OAuth token
         token = get_access_token()
         
-        # Fetch all prices
-        stations = fetch_all_prices(token)
+        # Fetch all prices in CMA format
+        try:
+            stations = fetch_all_prices(token)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 401:
+                raise
+            # A cached token may have been revoked early; get a new one once
+            logger.warning("Access token rejected, requesting a new one")
+            token = get_access_token(refresh=True)
+            stations = fetch_all_prices(token)
         
         if not stations:
-            logger.error("No stations fetched")
-            return 1
-        
-        # Transform to CMA format
-        cma_stations = transform_to_cma_format(stations)
-        
-        if not cma_stations:
-            logger.error("No valid stations after transformation")
+            logger.error("No valid stations fetched")
             return 1
         
         # Save output
@@ -401,23 +860,25 @@ def main() -> int:
             "data",
             "uk-fuel-prices.json"
         )
-        save_output(cma_stations, output_path)
+        save_output(stations, output_path)
         
-        logger.info(f"Successfully fetched and saved {len(cma_stations)} stations")
+        logger.info(f"Successfully fetched and saved {len(stations)} stations")
         return 0
         
     except ValueError as e:
         logger.error(f"Configuration error: {e}")
         return 1
-    except requests.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         logger.error(f"API error: {e}")
         return 1
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Network error: {e}")
         return 1
     except Exception as e:
         logger.exception(f"Unexpected error: {e}")
         return 1
+    finally:
+        CLIENT.close()
 
 
 if __name__ == "__main__":